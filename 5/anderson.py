@@ -0,0 +1,89 @@
+"""Anderson-accelerated value iteration over the compiled transition model.
+
+Instead of stepping to T(V) every sweep, the next iterate extrapolates from the
+last `memory` iterates: it is the combination of past T(V)s whose residuals
+best cancel in the least-squares sense. The max in the Bellman operator can
+make such an extrapolation overshoot, so a step is only accepted while its
+residual stays within SAFEGUARD times the best residual seen so far; otherwise
+the history is dropped and the plain step T(V) is taken instead.
+
+    python anderson.py [task [gamma [memory [error]]]]
+"""
+import sys
+import time
+import numpy as np
+
+import part_2
+from model import CompiledModel, bellman_backup, load_model, value_iteration
+
+# a strict "never increase the residual" rule rejects too many useful steps near policy switches
+SAFEGUARD = 1.5
+
+
+def anderson_value_iteration(model: CompiledModel, gamma, error, max_iter=1000, memory=5, values=None,
+                             progress=None):
+    """Same contract as `model.value_iteration`: stops once max |T(V) - V| <= error.
+
+    Returns (values, greedy column per state, number of backups).
+    """
+    values = np.zeros(model.num_states) if values is None else values
+    target, policy = bellman_backup(model, values, gamma)
+    residual = target - values
+    sweeps = 1
+    target_diffs, residual_diffs = [], []
+    best = np.inf
+    for iteration in range(max_iter):
+        max_diff = np.abs(residual).max()
+        best = min(best, max_diff)
+        if progress is not None:
+            progress(iteration, max_diff)
+        if max_diff <= error:
+            break
+        candidate = target
+        if residual_diffs:
+            coef = np.linalg.lstsq(np.stack(residual_diffs, axis=1), residual, rcond=None)[0]
+            candidate = target - np.stack(target_diffs, axis=1) @ coef
+        new_target, new_policy = bellman_backup(model, candidate, gamma)
+        sweeps += 1
+        if candidate is not target and np.abs(new_target - candidate).max() > SAFEGUARD * best:
+            # safeguard: the extrapolation made the residual worse, take the plain step instead
+            target_diffs, residual_diffs = [], []
+            candidate = target
+            new_target, new_policy = bellman_backup(model, candidate, gamma)
+            sweeps += 1
+        new_residual = new_target - candidate
+        target_diffs.append(new_target - target)
+        residual_diffs.append(new_residual - residual)
+        if len(residual_diffs) > memory:
+            target_diffs.pop(0)
+            residual_diffs.pop(0)
+        target, residual, policy = new_target, new_residual, new_policy
+    return target, policy, sweeps
+
+
+def compare(model: CompiledModel, gamma, error, memory=5, max_iter=10 ** 5):
+    """Runs plain and accelerated value iteration to the same tolerance and reports both."""
+    start = time.perf_counter()
+    plain_values, plain_policy, plain_sweeps = value_iteration(model, gamma, error, max_iter)
+    plain_time = time.perf_counter() - start
+    start = time.perf_counter()
+    values, policy, sweeps = anderson_value_iteration(model, gamma, error, max_iter, memory)
+    anderson_time = time.perf_counter() - start
+    return {
+        "plain_sweeps": plain_sweeps,
+        "plain_seconds": plain_time,
+        "anderson_sweeps": sweeps,
+        "anderson_seconds": anderson_time,
+        "seconds_saved": plain_time - anderson_time,
+        "max_value_diff": float(np.abs(plain_values - values).max()),
+        "policy_diffs": int((plain_policy != policy).sum()),
+    }
+
+
+if __name__ == "__main__":
+    task = int(sys.argv[1]) if len(sys.argv) > 1 else part_2.task
+    gamma = float(sys.argv[2]) if len(sys.argv) > 2 else part_2.GAMMA
+    memory = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    error = float(sys.argv[4]) if len(sys.argv) > 4 else part_2.ERROR
+    for key, value in compare(load_model(task), gamma, error, memory).items():
+        print(f"{key}={value}")
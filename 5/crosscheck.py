@@ -0,0 +1,158 @@
+"""Cross-check value iteration against the LP.
+
+By default both solvers read the same compiled model, so any disagreement is a
+solver problem. The LP is the discounted primal over state-action occupancies
+with a uniform start distribution, so the duals of its flow constraints are
+the optimal values of every state.
+
+With `lp="part_3"` the LP side is the one part_3.py runs instead: part_3's own
+dynamics (`model.compile_part_3`), its rewards and its undiscounted flow rows,
+only with every state as a start so the duals cover all states. VI still runs
+on part_2's model, so this is the check for drift between the two scripts: the
+report also lists the (state, action) columns whose dynamics or expected
+rewards differ between the two compiled models.
+
+    python crosscheck.py [task [gamma [tolerance [part_2|part_3]]]]
+"""
+import sys
+import numpy as np
+
+import part_2
+from model import CompiledModel, flow_matrix, load_model, value_iteration
+from part_2 import Actions
+
+MAX_SHOWN = 20
+
+
+class CrossCheckReport:
+    def __init__(self, model: CompiledModel, gamma, tolerance, vi_values, vi_policy, vi_sweeps, lp_values, lp_policy,
+                 lp_model: CompiledModel = None, lp_gamma=None):
+        self.model: CompiledModel = model
+        self.gamma: float = gamma
+        self.tolerance: float = tolerance
+        self.lp_model: CompiledModel = model if lp_model is None else lp_model
+        self.lp_gamma: float = gamma if lp_gamma is None else lp_gamma
+        self.vi_values: np.ndarray = vi_values
+        self.vi_policy: np.ndarray = vi_policy
+        self.vi_sweeps: int = vi_sweeps
+        self.lp_values: np.ndarray = lp_values
+        self.lp_actions: np.ndarray = self.lp_model.col_action[lp_policy]
+        # the LP's choice as a column of the VI model, -1 if VI's model has no such action there
+        self.lp_policy: np.ndarray = column_map(model, self.lp_model)[lp_policy]
+        self.value_diff: np.ndarray = np.abs(vi_values - lp_values)
+        # how much worse the LP's action is than the best action, judged by the VI values
+        q = model.q_values(vi_values, gamma)
+        self.action_gap: np.ndarray = np.where(self.lp_policy >= 0, vi_values - q[self.lp_policy], np.inf)
+        if self.lp_model is model:
+            self.dynamics_diffs = self.reward_diffs = self.missing = np.array([], dtype=np.int64)
+        else:
+            self.dynamics_diffs, self.reward_diffs, self.missing = model_diff(model, self.lp_model)
+
+    @property
+    def value_disagreements(self) -> np.ndarray:
+        return np.flatnonzero(self.value_diff > self.tolerance)
+
+    @property
+    def policy_disagreements(self) -> np.ndarray:
+        """States where the policies pick different actions and the LP's is not a tie under VI values."""
+        return np.flatnonzero((self.vi_policy != self.lp_policy) & (self.action_gap > self.tolerance))
+
+    @property
+    def ties(self) -> np.ndarray:
+        return np.flatnonzero((self.vi_policy != self.lp_policy) & (self.action_gap <= self.tolerance))
+
+    @property
+    def ok(self) -> bool:
+        return (len(self.value_disagreements) == 0 and len(self.policy_disagreements) == 0
+                and len(self.dynamics_diffs) == 0 and len(self.reward_diffs) == 0 and len(self.missing) == 0)
+
+    def __str__(self):
+        model = self.model
+        lines = [f"task={model.task} step_cost={model.step_cost} gamma={self.gamma} tolerance={self.tolerance}"]
+        if self.lp_model is not model:
+            lines.append(f"LP over part_3's dynamics, gamma={self.lp_gamma}: {len(self.dynamics_diffs)} columns with "
+                         f"different dynamics, {len(self.reward_diffs)} with different expected rewards, "
+                         f"{len(self.missing)} missing from one model")
+            for kind, cols in (("dynamics", self.dynamics_diffs), ("reward", self.reward_diffs)):
+                for col in cols[:MAX_SHOWN]:
+                    lines.append(f"    {kind} {model.label(model.col_state[col])} {Actions(model.col_action[col]).name}")
+        lines += [f"VI sweeps={self.vi_sweeps} max |V_vi - V_lp|={self.value_diff.max():.6f}",
+                  f"{len(self.value_disagreements)} value disagreements, {len(self.policy_disagreements)} "
+                  f"policy disagreements, {len(self.ties)} tied actions"]
+        shown = np.union1d(self.value_disagreements, self.policy_disagreements)
+        for idx in shown[:MAX_SHOWN]:
+            vi_action, lp_action = Actions(model.col_action[self.vi_policy[idx]]), Actions(self.lp_actions[idx])
+            lines.append(f"    {model.label(idx)} VI {vi_action.name}=[{self.vi_values[idx]:0.4f}] "
+                         f"LP {lp_action.name}=[{self.lp_values[idx]:0.4f}] gap={self.action_gap[idx]:0.4f}")
+        if len(shown) > MAX_SHOWN:
+            lines.append(f"    ... {len(shown) - MAX_SHOWN} more")
+        return "\n".join(lines)
+
+
+def column_map(a: CompiledModel, b: CompiledModel) -> np.ndarray:
+    """For every column of b, the column of a with the same state and action, -1 if there is none."""
+    keys_a = a.col_state * len(Actions) + a.col_action
+    keys_b = b.col_state * len(Actions) + b.col_action
+    # actions of a state are in State.actions order, not sorted
+    order = np.argsort(keys_a, kind="stable")
+    pos = order[np.minimum(np.searchsorted(keys_a[order], keys_b), a.num_cols - 1)]
+    return np.where(keys_a[pos] == keys_b, pos, -1)
+
+
+def model_diff(a: CompiledModel, b: CompiledModel, tolerance=1e-9):
+    """Columns of a whose outcome distribution or expected reward differ in b, and (state, action)
+    pairs only one of the models has, as columns of a or else of b (offset by a.num_cols)."""
+    import scipy.sparse as sp
+    to_a = column_map(a, b)
+    shared = np.flatnonzero(to_a >= 0)
+    missing = np.concatenate((np.setdiff1d(np.arange(a.num_cols), to_a[shared]),
+                              a.num_cols + np.flatnonzero(to_a < 0)))
+    dist_a = sp.csr_matrix((a.prob, (a.trans_col, a.next_state)), shape=(a.num_cols, a.num_states))
+    dist_b = sp.csr_matrix((b.prob, (b.trans_col, b.next_state)), shape=(b.num_cols, b.num_states))
+    moved = np.asarray(abs(dist_a[to_a[shared]] - dist_b[shared]).sum(axis=1)).ravel()
+    reward_a = np.bincount(a.trans_col, weights=a.prob * a.reward, minlength=a.num_cols)
+    reward_b = np.bincount(b.trans_col, weights=b.prob * b.reward, minlength=b.num_cols)
+    changed = np.abs(reward_a[to_a[shared]] - reward_b[shared])
+    return np.sort(to_a[shared][moved > tolerance]), np.sort(to_a[shared][changed > tolerance]), missing
+
+
+def solve_lp(model: CompiledModel, gamma):
+    """Returns (values, occupancy-argmax column per state) of the discounted LP, raises unless it solved to optimality."""
+    import cvxpy as cp
+    reward = np.bincount(model.trans_col, weights=model.prob * model.reward, minlength=model.num_cols)
+    alpha = np.full(model.num_states, 1 / model.num_states)
+    x = cp.Variable(model.num_cols)
+    flow = flow_matrix(model, gamma) @ x == alpha
+    problem = cp.Problem(cp.Maximize(reward @ x), [flow, x >= 0])
+    problem.solve()
+    # an inaccurate solution would show up as disagreements that are the solver's, not the model's
+    if problem.status != cp.OPTIMAL:
+        raise ValueError(f"LP is {problem.status}, cannot cross-check against it")
+    occupancy = np.asarray(x.value)
+    return np.asarray(flow.dual_value), model.greedy(occupancy)[1]
+
+
+def crosscheck(task=None, step_cost=None, gamma=None, tolerance=1e-3, vi_error=None, lp="part_2") -> CrossCheckReport:
+    """VI on part_2's compiled model against the LP over the `lp` model (see the module docstring)."""
+    gamma = part_2.GAMMA if gamma is None else gamma
+    model = load_model(task, step_cost)
+    # stop VI well inside the tolerance: the error after a sweep of size e is at most e * gamma / (1 - gamma)
+    vi_error = tolerance * (1 - gamma) / 10 if vi_error is None else vi_error
+    vi_values, vi_policy, vi_sweeps = value_iteration(model, gamma, vi_error, max_iter=10 ** 6)
+    if lp == "part_3":
+        # part_3's LP is undiscounted
+        lp_model, lp_gamma = load_model(step_cost=model.step_cost, source="part_3"), 1
+    else:
+        lp_model, lp_gamma = model, gamma
+    lp_values, lp_policy = solve_lp(lp_model, lp_gamma)
+    return CrossCheckReport(model, gamma, tolerance, vi_values, vi_policy, vi_sweeps, lp_values, lp_policy,
+                            lp_model, lp_gamma)
+
+
+if __name__ == "__main__":
+    report = crosscheck(task=int(sys.argv[1]) if len(sys.argv) > 1 else None,
+                        gamma=float(sys.argv[2]) if len(sys.argv) > 2 else None,
+                        tolerance=float(sys.argv[3]) if len(sys.argv) > 3 else 1e-3,
+                        lp=sys.argv[4] if len(sys.argv) > 4 else "part_2")
+    print(report)
+    sys.exit(0 if report.ok else 1)
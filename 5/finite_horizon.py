@@ -0,0 +1,74 @@
+"""Finite-horizon backward induction over the compiled transition model.
+
+Answers "best action with T steps left" directly instead of approximating it
+with a small discount factor. Each stage is one vectorized backup, so a
+T-stage solve costs O(T * nnz). Stage policies are stored only at the stages
+where they change, and stage values only every `checkpoint` stages; values in
+between are recomputed from the nearest checkpoint on demand, keeping memory
+bounded for large T.
+
+    python finite_horizon.py T [task]
+"""
+from bisect import bisect_right
+from math import isqrt
+import sys
+import numpy as np
+
+from model import CompiledModel, bellman_backup, compile_model
+
+
+class FiniteHorizon:
+    def __init__(self, model: CompiledModel, horizon: int, gamma: float = 1.0, checkpoint: int = None,
+                 terminal=None):
+        self.model: CompiledModel = model
+        self.horizon: int = horizon
+        self.gamma: float = gamma
+        self.checkpoint: int = checkpoint or max(1, isqrt(horizon))
+        self.terminal: np.ndarray = np.zeros(model.num_states) if terminal is None else np.asarray(terminal)
+        # policy_stages[i] is the first stage (steps left) at which policies[i] is optimal
+        self.policy_stages: [int] = []
+        self.policies: [np.ndarray] = []
+        self.checkpoints = {}
+
+    def solve(self):
+        values = self.terminal
+        self.checkpoints = {0: values}
+        self.policy_stages, self.policies = [], []
+        for stage in range(1, self.horizon + 1):
+            values, policy = bellman_backup(self.model, values, self.gamma)
+            if not self.policies or not np.array_equal(policy, self.policies[-1]):
+                self.policy_stages.append(stage)
+                self.policies.append(policy)
+            if stage % self.checkpoint == 0 or stage == self.horizon:
+                self.checkpoints[stage] = values
+        return self
+
+    def policy_at(self, steps_left: int) -> np.ndarray:
+        """Greedy column per state with `steps_left` (1..horizon) steps to go."""
+        if not 1 <= steps_left <= self.horizon:
+            raise ValueError(f"steps_left must be in 1..{self.horizon}, got {steps_left}")
+        return self.policies[bisect_right(self.policy_stages, steps_left) - 1]
+
+    def values_at(self, steps_left: int) -> np.ndarray:
+        if not 0 <= steps_left <= self.horizon:
+            raise ValueError(f"steps_left must be in 0..{self.horizon}, got {steps_left}")
+        stage = steps_left - steps_left % self.checkpoint
+        values = self.checkpoints[stage]
+        while stage < steps_left:
+            values, _ = bellman_backup(self.model, values, self.gamma)
+            stage += 1
+        return values
+
+    def action(self, steps_left: int, state: int):
+        return self.model.actions(self.policy_at(steps_left)[[state]])[0]
+
+
+if __name__ == "__main__":
+    T = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    task = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    fh = FiniteHorizon(compile_model(task=task), T).solve()
+    print(f"policy changes at stages {fh.policy_stages}")
+    start = CompiledModel.index(4, 2, 3, 1, 4)
+    for steps_left in fh.policy_stages:
+        print(f"T={steps_left}", CompiledModel.label(start), fh.action(steps_left, start).name,
+              "=[{:0.4f}]".format(fh.values_at(steps_left)[start]))
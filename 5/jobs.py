@@ -0,0 +1,265 @@
+"""Asyncio job runner for value iteration, LP and simulation solves.
+
+Jobs are submitted with a kind ("vi", "lp", "simulate" or "crosscheck") and a config dict,
+run in their own worker process (the solvers keep their parameters in module
+globals, so one process per job keeps concurrent studies isolated) and stream
+progress events back while they run. Every job writes into its own directory
+under the runner's output directory.
+
+    python jobs.py jobs.json [max_workers]
+
+where jobs.json is a list of {"kind": ..., "config": {...}} objects.
+"""
+from enum import Enum
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+import uuid
+
+POLL_INTERVAL = 0.05
+
+
+class JobStatus(Enum):
+    PENDING, RUNNING, DONE, FAILED, CANCELLED = range(5)
+
+
+def _configure(module, config):
+    if "x" in config:
+        module.X = config["x"]
+        module.Y = module.arr[module.X % 3]
+        module.STEP_COST = -10 / module.Y
+    module.STEP_COST = config.get("step_cost", module.STEP_COST)
+    module.GAMMA = config.get("gamma", module.GAMMA)
+    module.ERROR = config.get("error", module.ERROR)
+
+
+def _train(config, out_dir, report):
+    import part_2
+    _configure(part_2, config)
+    part_2.task = config.get("task", part_2.task)
+    part_2.file = open(os.path.join(out_dir, "trace.txt"), "w")
+    vi = part_2.ValueIteration()
+    vi.states = part_2.init_states()
+    vi.progress = lambda iteration, residual: report(iteration=iteration, residual=residual)
+    from trace_store import TraceStore
+    vi.trace = TraceStore(os.path.join(out_dir, "trace_store")).writer("trace")
+    vi.train(config.get("max_iter", 1000), config.get("anderson", 0))
+    part_2.file.close()
+    with open(os.path.join(out_dir, "policy.json"), "w") as f:
+        json.dump([{"state": str(state), "action": state.favoured_action.name, "value": state.value}
+                   for state in vi.states], f)
+    return vi
+
+
+def run_vi(config, out_dir, report):
+    vi = _train(config, out_dir, report)
+    return {"iterations": vi.iteration + 1}
+
+
+def run_lp(config, out_dir, report):
+    import part_3
+    _configure(part_3, config)
+    report(phase="solve")
+    lpp = part_3.LPP(part_3.init_states(), output=os.path.join(out_dir, "part_3_output.json"))
+    return {"objective": lpp.solution}
+
+
+def run_simulation(config, out_dir, report):
+    import random
+    import part_2
+    vi = _train(config, out_dir, report)
+    report(phase="simulate")
+    random.seed(config.get("seed"))
+    start = config.get("start", {})
+    initial_state = part_2.State(value=0,
+                                 position=part_2.Positions[start.get("pos", "C")].value,
+                                 materials=start.get("materials", 2),
+                                 arrows=start.get("arrows", 0),
+                                 mm_state=part_2.MMState[start.get("mm_state", "R")].value,
+                                 health=start.get("health", 100) // 25)
+    path = vi.simulate(initial_state, config.get("max_steps", 10000))
+    return {"iterations": vi.iteration + 1, "steps": len(path) - 1, "path": [str(state) for state in path]}
+
+
+def run_crosscheck(config, out_dir, report):
+    import part_2
+    from crosscheck import crosscheck
+    _configure(part_2, config)
+    report(phase="crosscheck")
+    result = crosscheck(task=config.get("task"), tolerance=config.get("tolerance", 1e-3), lp=config.get("lp", "part_2"))
+    with open(os.path.join(out_dir, "crosscheck.txt"), "w") as f:
+        print(result, file=f)
+    return {"ok": result.ok, "vi_sweeps": result.vi_sweeps, "max_value_diff": float(result.value_diff.max()),
+            "value_disagreements": len(result.value_disagreements),
+            "policy_disagreements": len(result.policy_disagreements),
+            "dynamics_diffs": len(result.dynamics_diffs), "reward_diffs": len(result.reward_diffs)}
+
+
+RUNNERS = {
+    "vi": run_vi,
+    "lp": run_lp,
+    "simulate": run_simulation,
+    "crosscheck": run_crosscheck,
+}
+
+
+def _worker(kind, config, out_dir, conn):
+    log = open(os.path.join(out_dir, "log.txt"), "w")
+    sys.stdout = sys.stderr = log
+    try:
+        result = RUNNERS[kind](config, out_dir, lambda **event: conn.send(("progress", event)))
+        conn.send(("result", result))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        log.flush()
+        conn.close()
+
+
+class Job:
+    def __init__(self, job_id, kind, config, out_dir):
+        self.id: str = job_id
+        self.kind: str = kind
+        self.config: dict = config
+        self.out_dir: str = out_dir
+        self.status: JobStatus = JobStatus.PENDING
+        self.result = None
+        self.error = None
+        self.last_progress = None
+        self._events = asyncio.Queue()
+        self._task = None
+
+    async def events(self):
+        """Yields progress events as they arrive, until the job finishes.
+
+        Events are consumed, so a job's stream should have a single reader.
+        """
+        while True:
+            event = await self._events.get()
+            if event is None:
+                return
+            yield event
+
+    async def wait(self):
+        try:
+            await asyncio.shield(self._task)
+        except asyncio.CancelledError:
+            if not self._task.done():
+                raise
+        return self
+
+    def __str__(self):
+        return f"{self.id}:{self.status.name}"
+
+
+class JobRunner:
+    def __init__(self, max_workers=2, output_dir="outputs/jobs"):
+        self.max_workers: int = max_workers
+        self.output_dir: str = output_dir
+        self.jobs = {}
+        self._slots = asyncio.Semaphore(max_workers)
+        self._context = multiprocessing.get_context("spawn")
+
+    def submit(self, kind, config=None) -> Job:
+        if kind not in RUNNERS:
+            raise ValueError(f"unknown job kind {kind!r}, expected one of {sorted(RUNNERS)}")
+        config = dict(config or {})
+        job_id = f"{kind}-{uuid.uuid4().hex[:8]}"
+        out_dir = os.path.join(self.output_dir, job_id)
+        os.makedirs(out_dir)
+        with open(os.path.join(out_dir, "config.json"), "w") as f:
+            json.dump({"kind": kind, "config": config}, f)
+        job = Job(job_id, kind, config, out_dir)
+        job._task = asyncio.ensure_future(self._run(job))
+        self.jobs[job_id] = job
+        return job
+
+    def cancel(self, job_id) -> bool:
+        job = self.jobs[job_id]
+        if job._task.done():
+            return False
+        job._task.cancel()
+        return True
+
+    async def wait_all(self):
+        return [await job.wait() for job in list(self.jobs.values())]
+
+    async def shutdown(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        await self.wait_all()
+
+    async def _run(self, job: Job):
+        process = None
+        try:
+            async with self._slots:
+                job.status = JobStatus.RUNNING
+                job._events.put_nowait({"status": job.status.name})
+                receiver, sender = self._context.Pipe(duplex=False)
+                process = self._context.Process(target=_worker, args=(job.kind, job.config, job.out_dir, sender),
+                                                daemon=True)
+                process.start()
+                sender.close()
+                await self._pump(job, receiver, process)
+        except asyncio.CancelledError:
+            job.status = JobStatus.CANCELLED
+            if process is not None and process.is_alive():
+                process.terminate()
+                await asyncio.to_thread(process.join)
+        except Exception:
+            job.status = JobStatus.FAILED
+            job.error = traceback.format_exc()
+        finally:
+            with open(os.path.join(job.out_dir, "status.json"), "w") as f:
+                json.dump({"status": job.status.name, "result": job.result, "error": job.error}, f)
+            job._events.put_nowait({"status": job.status.name})
+            job._events.put_nowait(None)
+
+    @staticmethod
+    async def _pump(job: Job, receiver, process):
+        finished = False
+        while not finished:
+            while receiver.poll():
+                try:
+                    kind, payload = receiver.recv()
+                except EOFError:
+                    finished = True
+                    break
+                if kind == "progress":
+                    job.last_progress = payload
+                    job._events.put_nowait(payload)
+                elif kind == "result":
+                    job.result = payload
+                    job.status = JobStatus.DONE
+                else:
+                    job.error = payload
+                    job.status = JobStatus.FAILED
+            if not finished:
+                await asyncio.sleep(POLL_INTERVAL)
+        # joining in a thread keeps the other jobs' progress streams flowing
+        await asyncio.to_thread(process.join)
+        if job.status == JobStatus.RUNNING:
+            job.status = JobStatus.FAILED
+            job.error = f"worker exited with code {process.exitcode}"
+
+
+async def _main(path, max_workers):
+    with open(path) as f:
+        specs = json.load(f)
+    runner = JobRunner(max_workers)
+    jobs = [runner.submit(spec["kind"], spec.get("config")) for spec in specs]
+
+    async def follow(job):
+        async for event in job.events():
+            print(job.id, event)
+
+    await asyncio.gather(*(follow(job) for job in jobs))
+    for job in jobs:
+        print(job, job.out_dir, job.error or "")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 2))
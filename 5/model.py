@@ -0,0 +1,232 @@
+"""Compiled, array-based form of the part_2 transition model.
+
+Every (state, legal action) pair is a column. Columns of a state are contiguous
+and ordered like `State.actions`, and the outcomes of a column are stored
+CSR-style in flat arrays, so a Bellman backup over all 600 states is a handful
+of numpy operations instead of a Python loop that deep-copies dicts.
+
+part_3's LP has its own copy of the dynamics (`part_3.action_value`), which is
+compiled into the same arrays with `source="part_3"`.
+
+Compiled models are cached on disk under a hash of the transition code and its
+parameters and memory-mapped back in, so short runs skip the expansion:
+
+    python model.py [task [gamma [POS MAT ARROWS MMSTATE HEALTH]]]
+"""
+from typing import List
+import hashlib
+import json
+import os
+import shutil
+import sys
+import numpy as np
+
+import part_2
+from part_2 import Actions, Arrows, Health, Materials, MMState, Positions, State, ValueIteration
+
+SHAPE = (len(Positions), len(Materials), len(Arrows), len(MMState), len(Health))
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".model_cache")
+ARRAYS = ("state_ptr", "col_action", "col_ptr", "next_state", "prob", "reward", "hit")
+SOURCES = ("part_2", "part_3")
+
+
+class CompiledModel:
+    def __init__(self, state_ptr, col_action, col_ptr, next_state, prob, reward, hit, task, step_cost):
+        # columns of state s are state_ptr[s]:state_ptr[s + 1]
+        self.state_ptr: np.ndarray = state_ptr
+        self.col_action: np.ndarray = col_action
+        # outcomes of column c are col_ptr[c]:col_ptr[c + 1], terminal columns have none
+        self.col_ptr: np.ndarray = col_ptr
+        self.next_state: np.ndarray = next_state
+        self.prob: np.ndarray = prob
+        self.reward: np.ndarray = reward
+        self.hit: np.ndarray = hit
+        self.task: int = task
+        self.step_cost: float = step_cost
+        self.num_states: int = len(state_ptr) - 1
+        self.num_cols: int = len(col_action)
+        self.col_state: np.ndarray = np.repeat(np.arange(self.num_states), np.diff(state_ptr))
+        self.trans_col: np.ndarray = np.repeat(np.arange(self.num_cols), np.diff(col_ptr))
+
+    @staticmethod
+    def index(pos, materials, arrows, mm_state, health) -> int:
+        return int(np.ravel_multi_index((pos, materials, arrows, mm_state, health), SHAPE))
+
+    @staticmethod
+    def label(idx) -> str:
+        pos, mat, arrow, mmst, health = np.unravel_index(idx, SHAPE)
+        return f"({Positions(pos).name},{mat},{arrow},{MMState(mmst).name},{health * 25})"
+
+    def actions(self, policy) -> List[Actions]:
+        return [Actions(action) for action in self.col_action[policy]]
+
+    def q_values(self, values, gamma) -> np.ndarray:
+        contrib = self.prob * (self.reward + gamma * values[self.next_state])
+        return np.bincount(self.trans_col, weights=contrib, minlength=self.num_cols)
+
+    def greedy(self, q):
+        """Per-state maximum of `q` and the first column attaining it, like `list.index(max(...))`."""
+        best = np.maximum.reduceat(q, self.state_ptr[:-1])
+        cols = np.flatnonzero(q >= best[self.col_state])
+        _, first = np.unique(self.col_state[cols], return_index=True)
+        return best, cols[first]
+
+
+def bellman_backup(model: CompiledModel, values, gamma):
+    """One synchronous sweep, returns (new values, greedy column per state)."""
+    return model.greedy(model.q_values(values, gamma))
+
+
+def value_iteration(model: CompiledModel, gamma, error, max_iter=1000, values=None, progress=None):
+    """Synchronous value iteration, stops once no state value moves by more than `error`.
+
+    Returns (values, greedy column per state, number of sweeps).
+    """
+    values = np.zeros(model.num_states) if values is None else values
+    for iteration in range(max_iter):
+        new_values, policy = bellman_backup(model, values, gamma)
+        max_diff = np.abs(new_values - values).max()
+        values = new_values
+        if progress is not None:
+            progress(iteration, max_diff)
+        if max_diff <= error:
+            break
+    return values, policy, iteration + 1
+
+
+def flow_matrix(model: CompiledModel, gamma):
+    """Sparse (states x columns) matrix of outflow minus discounted inflow."""
+    import scipy.sparse as sp
+    cols = np.arange(model.num_cols)
+    rows = np.concatenate((model.col_state, model.next_state))
+    entries = np.concatenate((cols, model.trans_col))
+    values = np.concatenate((np.ones(model.num_cols), -gamma * model.prob))
+    return sp.csr_matrix((values, (rows, entries)), shape=(model.num_states, model.num_cols))
+
+
+def compile_model(task=None, step_cost=None) -> CompiledModel:
+    """Expands `ValueIteration.transitions` once for every state and legal action.
+
+    Defaults to the task and step cost currently configured in part_2.
+    """
+    saved = part_2.task, part_2.STEP_COST
+    part_2.task = saved[0] if task is None else task
+    part_2.STEP_COST = saved[1] if step_cost is None else step_cost
+    try:
+        states: List[State] = part_2.init_states()
+        state_ptr, col_action, col_ptr = [0], [], [0]
+        next_state, prob, reward, hit = [], [], [], []
+        for state in states:
+            for action in state.actions:
+                results, got_hit = ValueIteration.transitions(action, state)
+                for idx, (pr, info) in enumerate(results):
+                    next_state.append(ValueIteration.getIdx(info))
+                    prob.append(pr)
+                    reward.append(ValueIteration.reward(action, info, got_hit == idx))
+                    hit.append(got_hit == idx)
+                col_action.append(action.value)
+                col_ptr.append(len(next_state))
+            state_ptr.append(len(col_action))
+        return CompiledModel(np.array(state_ptr, dtype=np.int64), np.array(col_action, dtype=np.int8),
+                             np.array(col_ptr, dtype=np.int64), np.array(next_state, dtype=np.int64),
+                             np.array(prob), np.array(reward), np.array(hit, dtype=bool),
+                             part_2.task, part_2.STEP_COST)
+    finally:
+        part_2.task, part_2.STEP_COST = saved
+
+
+def compile_part_3(step_cost) -> CompiledModel:
+    """Expands `part_3.action_value`, the dynamics part_3's LP is built from.
+
+    part_3 drops self-transitions from its outcome lists, so its flow rows only
+    hold the outflow 1 - p_self. The dropped mass goes back in here as a single
+    self-transition: columns stay distributions and `flow_matrix(model, 1)` gives
+    back exactly part_3's rows. Rewards follow `LPP.initialize_r`: the step cost
+    on every outcome and -40 on the (shifted) `got_hit` one, no kill reward.
+    """
+    import part_3
+    state_ptr, col_action, col_ptr = [0], [], [0]
+    next_state, prob, reward, hit = [], [], [], []
+    for state in part_3.init_states():
+        for action in state.actions:
+            if action != part_3.Actions.NONE:
+                got_hit, results = part_3.action_value(action, state)
+                for idx, (pr, info) in enumerate(results):
+                    next_state.append(part_3.LPP.getIdx(info))
+                    prob.append(pr)
+                    reward.append(step_cost + (-40 if idx == got_hit else 0))
+                    hit.append(idx == got_hit)
+                stay = 1 - sum(pr for pr, _ in results)
+                if stay > 1e-12:
+                    next_state.append(state.get_number())
+                    prob.append(stay)
+                    reward.append(step_cost)
+                    hit.append(False)
+            col_action.append(action.value)
+            col_ptr.append(len(next_state))
+        state_ptr.append(len(col_action))
+    return CompiledModel(np.array(state_ptr, dtype=np.int64), np.array(col_action, dtype=np.int8),
+                         np.array(col_ptr, dtype=np.int64), np.array(next_state, dtype=np.int64),
+                         np.array(prob), np.array(reward), np.array(hit, dtype=bool), None, step_cost)
+
+
+def spec_hash(task, step_cost, source="part_2") -> str:
+    digest = hashlib.sha256()
+    for path in (os.path.join(os.path.dirname(os.path.abspath(__file__)), source + ".py"), __file__):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    digest.update(repr((SHAPE, source, task, float(step_cost))).encode())
+    return digest.hexdigest()[:16]
+
+
+def save_model(model: CompiledModel, path):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp, name + ".npy"), getattr(model, name))
+    with open(os.path.join(tmp, "spec.json"), "w") as f:
+        json.dump({"task": model.task, "step_cost": model.step_cost}, f)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # another process cached the same spec first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_model(task=None, step_cost=None, cache_dir=CACHE_DIR, source="part_2") -> CompiledModel:
+    """Compiled model for the given parameters, from the disk cache when possible.
+
+    `source="part_3"` compiles part_3's dynamics instead, which have no task (it is ignored).
+    """
+    if source not in SOURCES:
+        raise ValueError(f"unknown model source {source}, expected one of {SOURCES}")
+    if source == "part_3":
+        import part_3
+        task = None
+        step_cost = part_3.STEP_COST if step_cost is None else step_cost
+    else:
+        task = part_2.task if task is None else task
+        step_cost = part_2.STEP_COST if step_cost is None else step_cost
+    path = os.path.join(cache_dir, spec_hash(task, step_cost, source))
+    if not os.path.isdir(path):
+        model = compile_model(task, step_cost) if source == "part_2" else compile_part_3(step_cost)
+        os.makedirs(cache_dir, exist_ok=True)
+        save_model(model, path)
+        return model
+    arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAYS]
+    return CompiledModel(*arrays, task, step_cost)
+
+
+if __name__ == "__main__":
+    task = int(sys.argv[1]) if len(sys.argv) > 1 else part_2.task
+    gamma = float(sys.argv[2]) if len(sys.argv) > 2 else part_2.GAMMA
+    model = load_model(task)
+    values, policy, sweeps = value_iteration(model, gamma, part_2.ERROR)
+    if len(sys.argv) > 3:
+        pos, mat, arrow, mmst, health = sys.argv[3:8]
+        queried = [model.index(Positions[pos].value, int(mat), int(arrow), MMState[mmst].value, int(health) // 25)]
+    else:
+        queried = range(model.num_states)
+    for idx, action in zip(queried, model.actions(policy[queried])):
+        print(model.label(idx) + ":" + action.name + "=[{:0.4f}]".format(values[idx]))
+    print(f"iteration={sweeps - 1}", file=sys.stderr)
@@ -3,7 +3,9 @@ from enum import Enum
 from typing import List
 import random
 import json
+import os
 import sys
+import time
 
 HEALTH = "HEALTH"
 POSITION = "POSITION"
@@ -12,6 +14,16 @@ ARROWS = "ARROWS"
 ACTIONS = "ACTIONS"
 MATERIALS = "MATERIALS"
 
+debug = False
+file = sys.stdout
+X = 5  # TODO change this for final_results
+arr = [1 / 2, 1, 2]
+Y = arr[X % 3]
+STEP_COST = -10 / Y
+GAMMA = 0.999
+ERROR = 0.001
+task = 1
+
 
 class Health(Enum):
     H_0, H_25, H_50, H_75, H_100 = range(5)
@@ -62,12 +74,26 @@ class State:
             HEALTH: self.health,
         }
 
+    def filter_action(self, action: Actions):
+        if action == Actions.SHOOT:
+            return self.arrows.value > 0
+        elif action == Actions.CRAFT:
+            return self.materials.value > 0
+        elif action == Actions.NONE:
+            return self.health == Health.H_0
+        else:
+            return True
+
 
 class ValueIteration:
     def __init__(self):
         self.states: [State] = []
         self.discount_factor: float = GAMMA
         self.iteration: int = -1
+        # called with (iteration, max_diff) after every sweep
+        self.progress = None
+        # trace_store.TraceWriter receiving every sweep, closed at the end of train
+        self.trace = None
 
     def iterate(self):
         self.iteration += 1
@@ -91,19 +117,58 @@ class ValueIteration:
                 stop = False
             max_diff = max(max_diff, abs(diff))
         print(max_diff, file=sys.stderr)
+        if self.progress is not None:
+            self.progress(self.iteration, max_diff)
+        if self.trace is not None:
+            self.trace.record(self.iteration, [state.value for state in new_states],
+                              [state.favoured_action.value for state in new_states])
         self.states = new_states
         if stop:
             return -1
         return 0
 
     def action_value(self, action: Actions, state: State):
-        results = []
         if debug:
             print(action.name)
+        if action == Actions.NONE:
+            return state.value, []
+        final_results, got_hit = self.transitions(action, state)
+
+        value: float = 0
+        for idx, result in enumerate(final_results):
+            # print("value is " + str(self.getvalue(result[1])))
+            if debug:
+                print("{:0.4f}".format(
+                    result[0]) + f", state={self.getState(result[1])} value={self.getState(result[1]).value}")
+            value += result[0] * (self.reward(action, result[1], got_hit == idx) +
+                                  GAMMA * self.getState(result[1]).value)
+        if debug:
+            print(value)
+        return value, final_results
+
+    @staticmethod
+    def reward(action: Actions, info, got_hit: bool) -> float:
+        reward = 0
+        step = STEP_COST
+        # for the other task
+        if task == 2:
+            if action == Actions.STAY:
+                step = 0
+        if got_hit:
+            reward = -40
+            # STEP = -40
+        if info[HEALTH].value == 0:
+            reward = 50
+        return step + reward
+
+    @staticmethod
+    def transitions(action: Actions, state: State):
+        """Returns ([(probability, next state info)], index of the outcome where MM hits, or -1)."""
+        results = []
         # result[0] is unsuccessful state, result[1:] are successful
         new_state_info = state.get_info()
         if action == Actions.NONE:
-            return state.value, []
+            return [], -1
         if state.pos == Positions.C:
             if action == Actions.UP:
                 # unsuccessful
@@ -148,9 +213,6 @@ class ValueIteration:
                     # successful
                     new_state_info[HEALTH] = Health(max(0, new_state_info[HEALTH].value - 1))
                     results.append((0.5, deepcopy(new_state_info)))
-                else:
-                    assert False
-                    # unsuccessful
             elif action == Actions.HIT:
                 # unsuccessful
                 results.append((0.9, deepcopy(new_state_info)))
@@ -187,9 +249,6 @@ class ValueIteration:
                     new_state_info[MATERIALS] = Materials(new_state_info[MATERIALS].value - 1)
                     new_state_info[ARROWS] = Arrows(min(new_state_info[ARROWS].value + 3, len(Arrows) - 1))
                     results.append((0.15, deepcopy(new_state_info)))
-                else:
-                    assert False
-                    # unsuccessful
 
         elif state.pos == Positions.S:
             if action == Actions.UP:
@@ -234,8 +293,6 @@ class ValueIteration:
                     # successful
                     new_state_info[HEALTH] = Health(max(0, new_state_info[HEALTH].value - 1))
                     results.append((0.9, deepcopy(new_state_info)))
-                else:
-                    assert False
             elif action == Actions.HIT:
                 # unsuccessful
                 results.append((0.8, deepcopy(new_state_info)))  # miss with high prob
@@ -259,10 +316,8 @@ class ValueIteration:
                     new_state_info[ARROWS] = Arrows(new_state_info[ARROWS].value - 1)
                     results.append((0.75, deepcopy(new_state_info)))
                     # successful
-                    new_state_info[HEALTH] = Health(new_state_info[HEALTH].value - 1)
+                    new_state_info[HEALTH] = Health(max(0, new_state_info[HEALTH].value - 1))
                     results.append((0.25, deepcopy(new_state_info)))
-                else:
-                    assert False
         # results [(pr, (new state))]
         final_results = []
         got_hit = -1
@@ -292,36 +347,7 @@ class ValueIteration:
                     result_state[MMSTATE] = MMState.D
                     final_results.append((0.5 * result[0], deepcopy(result_state)))
 
-
-        value: float = 0
-        total_prob: float = 0.0
-        for result in final_results:
-            total_prob += result[0]
-        # print(total)
-        assert (0.99 < total_prob < 1.01)
-
-        for idx, result in enumerate(final_results):
-            reward = 0
-
-            # print("value is " + str(self.getvalue(result[1])))
-            step = STEP_COST
-            # for the other task
-            if task == 2:
-                if action == Actions.STAY:
-                    step = 0
-            if got_hit == idx:
-                reward = -40
-                # print(result[1])
-                # STEP = -40
-            if result[1][HEALTH].value == 0:
-                reward = 50
-            if debug:
-                print("{:0.4f}".format(
-                    result[0]) + f", state={self.getState(result[1])} value={self.getState(result[1]).value}")
-            value += result[0] * (step + reward + GAMMA * self.getState(result[1]).value)
-        if debug:
-            print(value)
-        return value, final_results
+        return final_results, got_hit
 
     @classmethod
     def getIdx(cls, info):
@@ -333,13 +359,15 @@ class ValueIteration:
     def getState(self, info) -> State:
         # print(result)
         idx = self.getIdx(info)
-        assert (self.states[idx].get_info() == info)
         return self.states[idx]
 
-    def simulate(self, init_state):
+    def simulate(self, init_state, max_steps=None):
         current_state = self.getState(init_state.get_info())
+        path = [current_state]
         print("Now:", current_state, current_state.favoured_action)
         while current_state.health.value != 0:
+            if max_steps is not None and len(path) > max_steps:
+                break
             optimal_action = current_state.favoured_action
             possible_outcomes = self.action_value(optimal_action, current_state)[1]
             # print(optimal_action, current_state, possible_outcomes)
@@ -354,14 +382,41 @@ class ValueIteration:
                     current_state = self.getState(outcome[1])
                     print("Selected Outcome:", idx, "Rolled", "{:0.3f}".format(actual_outcome))
                     print(current_state, current_state.favoured_action)
+                    path.append(current_state)
                     break
+        return path
 
-    def train(self, max_iter):
+    def train(self, max_iter, anderson=0):
+        if anderson:
+            return self.train_anderson(max_iter, anderson)
         while self.iterate() != -1 and self.iteration < max_iter - 1:
             pass
+        if self.trace is not None:
+            self.trace.close()
         print(f"iteration={self.iteration}", file=sys.stderr)
         # self.dump_states()
 
+    def train_anderson(self, max_iter, memory):
+        """Anderson-accelerated value iteration over the last `memory` iterates on the compiled model."""
+        from anderson import anderson_value_iteration
+        from model import load_model
+        start = time.perf_counter()
+        model = load_model(task, STEP_COST)
+        values, policy, sweeps = anderson_value_iteration(model, GAMMA, ERROR, max_iter, memory,
+                                                          progress=self.progress)
+        for state, value, action in zip(self.states, values, model.actions(policy)):
+            state.value = value
+            state.favoured_action = action
+        self.iteration = sweeps - 1
+        print(f"iteration={self.iteration}", file=file)
+        for state in self.states:
+            print(str(state) + ":" + state.favoured_action.name + "=[{:0.4f}]".format(state.value), file=file)
+        if self.trace is not None:
+            self.trace.record(self.iteration, values, [action.value for action in model.actions(policy)])
+            self.trace.close()
+        print(f"iteration={self.iteration}", file=sys.stderr)
+        print(f"anderson m={memory}: {sweeps} backups in {time.perf_counter() - start:.3f}s", file=sys.stderr)
+
     def dump_states(self):
         with open(f"trained_states_{task}.txt", "w") as f:
             sts = []
@@ -395,22 +450,7 @@ class ValueIteration:
         print(action_array)
 
 
-if __name__ == "__main__":
-    debug = False
-    if len(sys.argv) == 2 and sys.argv[1] == "d":
-        debug = True
-    FILE = "outputs/part_2_task_2.3_trace.txt"
-    file = open(FILE, "w")
-    X = 5  # TODO change this for final_results
-    arr = [1 / 2, 1, 2]
-    Y = arr[X % 3]
-    STEP_COST = -10 / Y
-    # GAMMA = 0.25
-    GAMMA = 0.999
-    ERROR = 0.001
-    task = 3
-    if task == 3:
-        GAMMA = 0.25
+def init_states() -> List[State]:
     states_init = []
     for pos in range(len(Positions)):
         for mat in range(len(Materials)):
@@ -449,9 +489,25 @@ if __name__ == "__main__":
                             state_1.actions = [Actions.NONE]
                             state_1.value = 0
                         states_init.append(state_1)
+    return states_init
+
+
+if __name__ == "__main__":
+    debug = False
+    if len(sys.argv) == 2 and sys.argv[1] == "d":
+        debug = True
+    FILE = "outputs/part_2_task_2.3_trace.txt"
+    file = open(FILE, "w")
+    task = 3
+    if task == 3:
+        GAMMA = 0.25
+    states_init = init_states()
     vi = ValueIteration()
     vi.states = states_init
+    from trace_store import TraceStore
+    vi.trace = TraceStore().writer(os.path.splitext(os.path.basename(FILE))[0])
     vi.train(1000)
+    file.close()
     # vi.load_states()
     # vi.do()
     # vi.load_states()
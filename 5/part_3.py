@@ -2,9 +2,11 @@ from copy import deepcopy
 from enum import Enum
 from typing import List
 import json
+import os
 import sys
 import numpy as np
-import cvxpy as cp
+
+from model import CompiledModel, flow_matrix, load_model
 
 HEALTH = "HEALTH"
 POSITION = "POSITION"
@@ -38,6 +40,13 @@ debug = False
 if len(sys.argv) == 2 and sys.argv[1] == "d":
     debug = True
 
+X = 5  # TODO change this for final_results
+arr = [1 / 2, 1, 2]
+Y = arr[X % 3]
+STEP_COST = -10 / Y
+GAMMA = 0.999
+ERROR = 0.001
+
 
 class Actions(Enum):
     UP, LEFT, DOWN, RIGHT, STAY, SHOOT, HIT, CRAFT, GATHER, NONE = range(10)
@@ -249,7 +258,7 @@ def action_value(action: Actions, state: State):
                 new_state_info[ARROWS] = Arrows(new_state_info[ARROWS].value - 1)
                 results.append((0.75, deepcopy(new_state_info)))
                 # successful
-                new_state_info[HEALTH] = Health(new_state_info[HEALTH].value - 1)
+                new_state_info[HEALTH] = Health(max(0, new_state_info[HEALTH].value - 1))
                 results.append((0.25, deepcopy(new_state_info)))
             else:
                 assert False
@@ -293,12 +302,57 @@ def action_value(action: Actions, state: State):
     return got_hit, final_final_results
 
 
+class Constraint:
+    """Budget on the expected total of a cost over state-action columns: cost @ x <= budget.
+
+    `cost` is an array with one entry per LP column, or a function of the LPP returning one.
+    """
+
+    def __init__(self, name, cost, budget):
+        self.name: str = name
+        self.cost = cost
+        self.budget: float = budget
+        # filled in by the solve
+        self.value = None
+        self.dual = None
+        self.slack = None
+
+    def to_dict(self):
+        return {"budget": self.budget, "value": self.value, "dual": self.dual, "slack": self.slack}
+
+
+def arrows_spent(lpp):
+    """Every SHOOT uses one arrow, so cost @ x is the expected number of arrows spent."""
+    return (lpp.col_action == Actions.SHOOT.value).astype(float)
+
+
+def mm_hits(lpp):
+    """Probability that each column ends with an MM hit, cost @ x is the expected number of hits.
+
+    The expected number of hits bounds the probability of being hit at least once from
+    above, so a budget p on it is a conservative "P(hit) <= p".
+    """
+    model = lpp.model
+    return np.bincount(model.trans_col, weights=model.prob * model.hit, minlength=model.num_cols)
+
+
+COSTS = {
+    "arrows": arrows_spent,
+    "hits": mm_hits,
+}
+
+
 class LPP:
-    def __init__(self, states):
+    def __init__(self, states, output="outputs/part_3_output.json", summary=True, constraints=None, model=None):
         self.states: [State] = states
+        # a and r come from the compiled part_3 dynamics, cached on disk by model.load_model
+        self.model: CompiledModel = load_model(step_cost=STEP_COST, source="part_3") if model is None else model
+        # arrays go to <output>.npz, the JSON summary to output itself
+        self.output = output
+        self.summary = summary
         self.discount_factor: float = GAMMA
         self.iteration: int = -1
-        self.dim = sum([len(st.actions) for st in self.states])
+        self.dim = self.model.num_cols
         print("Dim is", self.dim)
         self.num_states = len(self.states)
         self.r = None
@@ -307,50 +361,43 @@ class LPP:
         self.solution = None
         self.x = None
         self.policy = None
+        self.state_ptr = None
+        self.col_state = None
+        self.col_action = None
+        self.policy_cols = None
+        self.occupancy = None
+        self.action_occupancy = None
+        self.contribution = None
+        self.constraints: List[Constraint] = constraints or []
+        self.c = None
+        self.initialize_index()
         self.initialize_r()
         self.initialize_a()
         self.initialize_alpha()
+        self.initialize_c()
         self.run_LP()
         self.get_solution()
         self.make_dict()
 
+    def initialize_index(self):
+        model = self.model
+        # columns of state s are state_ptr[s]:state_ptr[s + 1]
+        self.state_ptr = np.asarray(model.state_ptr)
+        self.col_state = model.col_state
+        self.col_action = np.asarray(model.col_action)
+        actions = [action.value for state in self.states for action in state.actions]
+        if model.num_states != self.num_states or not np.array_equal(self.col_action, actions):
+            raise ValueError("compiled model does not match the states' action lists")
+
     def initialize_r(self):
-        r = np.zeros((1, self.dim))
-        count = 0
-        for i, state in enumerate(self.states):
-            for action in state.actions:
-                got_hit, results = action_value(action, state)
-                # print(count, state, got_hit)
-                r[0][count] += STEP_COST
-                for idx, (pr, st) in enumerate(results):
-                    # print(self.getState(st))
-                    assert pr >= 0
-                    if action != Actions.NONE:
-                        if idx == got_hit:
-                            r[0][count] += pr * (-40)
-                            # print(r[0][count])
-                        # r[0][count] += pr * STEP_COST
-                    else:
-                        r[0][count] = 0
-                count += 1
-        self.r = r
+        model = self.model
+        # step cost on every column, -40 times the chance of being hit, 0 for NONE
+        self.r = np.bincount(model.trans_col, weights=model.prob * model.reward, minlength=self.dim)[None, :]
 
     def initialize_a(self):
-        a = np.zeros((self.num_states, self.dim))
-        action_no = 0
-        for state_no, cur_state in enumerate(self.states):
-            for action in cur_state.actions:
-                got_hit, results = action_value(action, cur_state)
-                if len(results) <= 0:
-                    print(cur_state, action)
-                assert len(results) > 0
-                for idx, (pr, next_state) in enumerate(results):
-                    a[state_no][action_no] += pr  # outflow
-                    if action != Actions.NONE:
-                        a[self.getState(next_state).get_number()][action_no] -= pr  # inflow
-                action_no += 1
-                assert state_no == cur_state.get_number()
-        self.a = a
+        # outflow minus inflow, undiscounted
+        self.a = flow_matrix(self.model, 1)
+        self.a.eliminate_zeros()
 
     def initialize_alpha(self):
         # starting probability is equal
@@ -361,43 +408,83 @@ class LPP:
         alpha[0][start_state.get_number()] = 1
         self.alpha = alpha.T
 
+    def initialize_c(self):
+        import scipy.sparse as sp
+        # one sparse row per budget constraint, next to the flow rows in a
+        rows = [np.asarray(con.cost(self) if callable(con.cost) else con.cost, dtype=float)
+                for con in self.constraints]
+        for con, row in zip(self.constraints, rows):
+            if row.shape != (self.dim,):
+                raise ValueError(f"constraint {con.name} has {row.shape} costs, expected ({self.dim},)")
+        self.c = sp.csr_matrix(np.array(rows).reshape(len(rows), self.dim))
+
     def run_LP(self):
+        import cvxpy as cp
         x = cp.Variable((self.dim, 1), 'x')
         print(x.shape, self.a.shape, self.alpha.shape, self.r.shape)
         constraints = [
-            cp.matmul(self.a, x) == self.alpha,
+            self.a @ x == self.alpha,
             x >= 0
         ]
+        if self.constraints:
+            budget = np.array([[con.budget] for con in self.constraints])
+            constraints.append(self.c @ x <= budget)
 
         objective = cp.Maximize(cp.matmul(self.r, x))
         problem = cp.Problem(objective, constraints)
 
         solution = problem.solve(verbose=True)
+        if problem.status not in (cp.OPTIMAL, cp.OPTIMAL_INACCURATE):
+            raise ValueError(f"LP is {problem.status}, check the constraint budgets")
         self.solution = solution
         self.x = x
+        if self.constraints:
+            # dual price: objective gained per unit of extra budget
+            duals = np.asarray(constraints[-1].dual_value).ravel()
+            values = self.c @ np.asarray(x.value).ravel()
+            for con, dual, value in zip(self.constraints, duals, values):
+                con.value, con.dual, con.slack = float(value), float(dual), float(con.budget - value)
 
     def get_solution(self):
-        xs = self.x.value.tolist()
-        count = 0
+        x = np.asarray(self.x.value).ravel()
+        # segment argmax: first column of every state holding the state's largest x
+        best = np.maximum.reduceat(x, self.state_ptr[:-1])
+        cols = np.flatnonzero(x >= best[self.col_state])
+        _, first = np.unique(self.col_state[cols], return_index=True)
+        self.policy_cols = cols[first]
+        # expected visits per state and per action, and each column's share of the objective
+        self.occupancy = np.bincount(self.col_state, weights=x, minlength=self.num_states)
+        self.action_occupancy = np.bincount(self.col_action, weights=x, minlength=len(Actions))
+        self.contribution = self.r[0] * x
         self.policy = []
-        for state in self.states:
-            action_len = len(state.actions)
-            options = xs[count: count + action_len]
-            max_arg = np.argmax(np.array(options))
-            state.favoured_action = state.actions[max_arg]
+        for state, col in zip(self.states, self.policy_cols - self.state_ptr[:-1]):
+            state.favoured_action = state.actions[col]
             self.policy.append([state.get_tuple(), state.favoured_action.name])
-            count += action_len
 
     def make_dict(self):
+        a = self.a.tocoo()
+        np.savez(os.path.splitext(self.output)[0] + ".npz",
+                 x=np.asarray(self.x.value).ravel(), r=self.r[0], alpha=self.alpha.T[0],
+                 a_rows=a.row, a_cols=a.col, a_values=a.data, a_shape=a.shape,
+                 state_ptr=self.state_ptr, col_state=self.col_state, col_action=self.col_action,
+                 policy=self.col_action[self.policy_cols], occupancy=self.occupancy,
+                 action_occupancy=self.action_occupancy, contribution=self.contribution,
+                 objective=self.solution,
+                 constraint_names=[con.name for con in self.constraints],
+                 constraint_costs=self.c.toarray(),
+                 constraint_duals=[con.dual for con in self.constraints],
+                 constraint_slack=[con.slack for con in self.constraints])
+        if not self.summary:
+            return
         d = {
-            "a": self.a.tolist(),
-            "r": self.r[0].tolist(),
-            "x": self.x.value.tolist(),
-            "alpha": self.alpha.T[0].tolist(),
+            "objective": self.solution,
             "policy": self.policy,
-            "objective": self.solution
+            "action_occupancy": {action.name: self.action_occupancy[action.value] for action in Actions},
+            "action_reward": {action.name: np.bincount(self.col_action, weights=self.contribution,
+                                                       minlength=len(Actions))[action.value] for action in Actions},
+            "constraints": {con.name: con.to_dict() for con in self.constraints},
         }
-        with open("outputs/part_3_output.json", "w") as f:
+        with open(self.output, "w") as f:
             json.dump(d, f)
 
     @classmethod
@@ -419,19 +506,7 @@ class LPP:
         return s
 
 
-if __name__ == "__main__":
-    debug = False
-    if len(sys.argv) == 2 and sys.argv[1] == "d":
-        debug = True
-
-    X = 5  # TODO change this for final_results
-    arr = [1 / 2, 1, 2]
-    Y = arr[X % 3]
-    STEP_COST = -10 / Y
-    # GAMMA = 0.25
-    GAMMA = 0.999
-    ERROR = 0.001
-
+def init_states() -> List[State]:
     states_init = []
     for pos in range(len(Positions)):
         for mat in range(len(Materials)):
@@ -469,4 +544,18 @@ if __name__ == "__main__":
                             state_1.value = 0
                         state_1.filter()
                         states_init.append(state_1)
-    LPP(states_init)
+    return states_init
+
+
+if __name__ == "__main__":
+    # e.g. python part_3.py arrows=2 hits=0.5
+    constraints = []
+    for arg in sys.argv[1:]:
+        if "=" in arg:
+            name, budget = arg.split("=")
+            constraints.append(Constraint(name, COSTS[name], float(budget)))
+
+    states_init = init_states()
+    lpp = LPP(states_init, constraints=constraints)
+    for con in lpp.constraints:
+        print(f"{con.name}: {con.value:0.4f} <= {con.budget} dual={con.dual:0.4f} slack={con.slack:0.4f}")
@@ -0,0 +1,192 @@
+"""Hidden MM state: point-based value iteration over beliefs about `MMState`.
+
+The agent still sees its position, materials, arrows and the MM's health (the
+observable part o of a state), but not whether the MM is dormant or ready. A
+belief is then a single number per observable state, b = P(MMState.R), and the
+problem is a mixed-observability POMDP over the same compiled transitions:
+legal actions only depend on o, so the D and R columns of o pair up action by
+action.
+
+Outcomes are grouped into branches (pair, next observation) holding
+P[branch, h, h'] = P(o', h' | o, h, a). The belief update is then two small
+tensor contractions, and a PBVI backup over B belief points per observable
+state costs O(branches * B^2) per sweep, independent of how finely the belief
+simplex would have to be gridded by an exact method. Each belief point keeps
+one alpha vector (one value per hidden state) and the action that produced it.
+
+Keeping one alpha per point makes the backup lose its contraction property, and
+started from zero it can settle into a cycle between two alphas. So the alphas
+start from the values of a policy that only looks at o (the fully observed
+policy of the dormant MM, a lower bound), and a backup only replaces the alpha
+of a point when it does not lower the value there: values then rise
+monotonically towards the point-based optimum and the iteration converges.
+
+    python pomdp.py [task [gamma [points]]]
+"""
+import sys
+import numpy as np
+
+import part_2
+from model import CompiledModel, SHAPE, load_model, value_iteration
+from part_2 import Actions, Health, MMState
+
+# observable state = state index with the MMState axis removed
+OBS_SHAPE = SHAPE[:3] + SHAPE[4:]
+MM_AXIS = 3
+
+
+class BeliefModel:
+    def __init__(self, model: CompiledModel):
+        self.model: CompiledModel = model
+        coords = np.unravel_index(np.arange(model.num_states), SHAPE)
+        state_obs = np.ravel_multi_index(coords[:MM_AXIS] + coords[MM_AXIS + 1:], OBS_SHAPE)
+        state_hidden = coords[MM_AXIS]
+        self.num_obs: int = int(np.prod(OBS_SHAPE))
+
+        # pair every R column with the D column of the same observable state and action
+        # both in observable state order, dormant[o] and ready[o] are the two states behind o
+        self.dormant: np.ndarray = np.flatnonzero(state_hidden == MMState.D.value)
+        dormant, ready = self.dormant, np.flatnonzero(state_hidden == MMState.R.value)
+        self.col_pair: np.ndarray = np.empty(model.num_cols, dtype=np.int64)
+        col_pair = self.col_pair
+        pair_cols = np.concatenate([np.arange(model.state_ptr[s], model.state_ptr[s + 1]) for s in dormant])
+        col_pair[pair_cols] = np.arange(len(pair_cols))
+        for s_dormant, s_ready in zip(dormant, ready):
+            col_pair[model.state_ptr[s_ready]:model.state_ptr[s_ready + 1]] = \
+                col_pair[model.state_ptr[s_dormant]:model.state_ptr[s_dormant + 1]]
+        if not np.array_equal(model.col_action[pair_cols][col_pair], model.col_action):
+            raise ValueError("legal actions depend on MMState, the MM state cannot be hidden")
+        self.num_pairs: int = len(pair_cols)
+        self.pair_action: np.ndarray = model.col_action[pair_cols]
+        self.pair_obs: np.ndarray = state_obs[model.col_state[pair_cols]]
+        # pairs of observable state o are obs_ptr[o]:obs_ptr[o + 1]
+        self.obs_ptr: np.ndarray = np.searchsorted(self.pair_obs, np.arange(self.num_obs + 1))
+
+        col_hidden = state_hidden[model.col_state]
+        self.reward: np.ndarray = np.zeros((self.num_pairs, 2))
+        np.add.at(self.reward, (col_pair[model.trans_col], col_hidden[model.trans_col]), model.prob * model.reward)
+
+        trans_pair = col_pair[model.trans_col]
+        next_obs = state_obs[model.next_state]
+        keys, trans_branch = np.unique(trans_pair * self.num_obs + next_obs, return_inverse=True)
+        # sorted, branch b is (pair, next observation) = divmod(branch_key[b], num_obs)
+        self.branch_key: np.ndarray = keys
+        self.branch_pair: np.ndarray = keys // self.num_obs
+        self.branch_obs: np.ndarray = keys % self.num_obs
+        self.prob: np.ndarray = np.zeros((len(keys), 2, 2))
+        np.add.at(self.prob, (trans_branch, col_hidden[model.trans_col], state_hidden[model.next_state]),
+                  model.prob)
+
+    def obs_index(self, pos, materials, arrows, health) -> int:
+        return int(np.ravel_multi_index((pos, materials, arrows, health), OBS_SHAPE))
+
+    def pairs(self, obs):
+        return np.arange(self.obs_ptr[obs], self.obs_ptr[obs + 1])
+
+    def backup(self, values, gamma):
+        """Q-values of every pair under alpha vectors `values[o, h]` of each observable state: (pairs, h)."""
+        backed = np.einsum("bhe,be->bh", self.prob, values[self.branch_obs])
+        q_values = self.reward.copy()
+        np.add.at(q_values, self.branch_pair, gamma * backed)
+        return q_values
+
+    def evaluate(self, pair_policy, gamma, error, max_iter=10 ** 5):
+        """Values (obs, h) of picking pair_policy[o] at every observable state o, whatever the MM state."""
+        values = np.zeros((self.num_obs, 2))
+        for _ in range(max_iter):
+            new_values = self.backup(values, gamma)[pair_policy]
+            max_diff = np.abs(new_values - values).max()
+            values = new_values
+            if max_diff <= error:
+                break
+        return values
+
+    def update(self, beliefs, pairs, next_obs):
+        """Vectorized belief update: returns (P(MM ready) after observing next_obs, probability of next_obs).
+
+        An observation that cannot follow its pair has likelihood 0 and leaves the belief as it was.
+        """
+        beliefs, keys = np.broadcast_arrays(np.asarray(beliefs, dtype=float),
+                                            np.asarray(pairs) * self.num_obs + np.asarray(next_obs))
+        branch = np.minimum(np.searchsorted(self.branch_key, keys), len(self.branch_key) - 1)
+        possible = self.branch_key[branch] == keys
+        weights = np.stack((1 - beliefs, beliefs), axis=-1)
+        joint = np.einsum("...h,...he->...e", weights, self.prob[branch]) * possible[..., None]
+        likelihood = joint.sum(axis=-1)
+        return np.where(likelihood > 0, joint[..., 1] / np.where(likelihood > 0, likelihood, 1), beliefs), likelihood
+
+
+class PBVI:
+    def __init__(self, beliefs: BeliefModel, gamma, points=11, error=part_2.ERROR):
+        self.beliefs: BeliefModel = beliefs
+        self.gamma: float = gamma
+        # the same bounded set of belief points, P(MM ready), at every observable state
+        self.points: np.ndarray = np.linspace(0, 1, points)
+        self.weights: np.ndarray = np.stack((1 - self.points, self.points), axis=1)
+        # lower bound: act as if the MM were dormant, which only needs o
+        policy = value_iteration(beliefs.model, gamma, error, max_iter=10 ** 5)[1]
+        lower = beliefs.evaluate(beliefs.col_pair[policy[beliefs.dormant]], gamma, error)
+        self.alphas: np.ndarray = np.repeat(lower[:, None, :], points, axis=1)
+        self.actions: np.ndarray = np.repeat(beliefs.pair_action[beliefs.col_pair[policy[beliefs.dormant]]][:, None],
+                                             points, axis=1)
+        self.sweeps: int = 0
+
+    def backup(self):
+        bm = self.beliefs
+        # value of each successor alpha k at o', pushed back through P(o', h' | o, h, a): (branch, h, k)
+        backed = np.einsum("bhe,bke->bhk", bm.prob, self.alphas[bm.branch_obs])
+        # for every belief point j of the source state, the best successor alpha per branch
+        best = np.einsum("jh,bhk->bjk", self.weights, backed).argmax(axis=2)
+        chosen = np.take_along_axis(backed, best[:, None, :], axis=2).transpose(0, 2, 1)
+        pair_alphas = np.repeat(bm.reward[:, None, :], len(self.points), axis=1)
+        np.add.at(pair_alphas, bm.branch_pair, self.gamma * chosen)
+        pair_values = np.einsum("jh,pjh->pj", self.weights, pair_alphas)
+        # best pair (action) of every observable state at every belief point, first one on ties
+        top = np.maximum.reduceat(pair_values, bm.obs_ptr[:-1], axis=0)
+        candidates = np.where(pair_values >= top[bm.pair_obs], np.arange(bm.num_pairs)[:, None], bm.num_pairs)
+        best_pair = np.minimum.reduceat(candidates, bm.obs_ptr[:-1], axis=0)
+        new_alphas = pair_alphas[best_pair, np.arange(len(self.points))]
+        new_actions = bm.pair_action[best_pair]
+        # keep the best old alpha of a point wherever the backup would lower its value
+        old_values = np.einsum("jh,okh->ojk", self.weights, self.alphas)
+        old_best = old_values.argmax(axis=2)
+        old_values = np.take_along_axis(old_values, old_best[..., None], axis=2)[..., 0]
+        new_values = np.einsum("jh,ojh->oj", self.weights, new_alphas)
+        worse = new_values < old_values
+        new_alphas[worse] = np.take_along_axis(self.alphas, old_best[..., None], axis=1)[worse]
+        new_actions[worse] = np.take_along_axis(self.actions, old_best, axis=1)[worse]
+        max_diff = np.abs(np.maximum(new_values, old_values) - old_values).max()
+        self.alphas, self.actions = new_alphas, new_actions
+        self.sweeps += 1
+        return max_diff
+
+    def solve(self, error, max_iter=1000, progress=None):
+        for iteration in range(max_iter):
+            max_diff = self.backup()
+            if progress is not None:
+                progress(iteration, max_diff)
+            if max_diff <= error:
+                break
+        return self
+
+    def value(self, obs, belief) -> float:
+        return float((self.alphas[obs] @ [1 - belief, belief]).max())
+
+    def action(self, obs, belief) -> Actions:
+        return Actions(self.actions[obs, (self.alphas[obs] @ [1 - belief, belief]).argmax()])
+
+
+if __name__ == "__main__":
+    task = int(sys.argv[1]) if len(sys.argv) > 1 else part_2.task
+    gamma = float(sys.argv[2]) if len(sys.argv) > 2 else part_2.GAMMA
+    points = int(sys.argv[3]) if len(sys.argv) > 3 else 11
+    model = load_model(task)
+    pbvi = PBVI(BeliefModel(model), gamma, points).solve(part_2.ERROR)
+    mdp_values = value_iteration(model, gamma, part_2.ERROR)[0]
+    print(f"PBVI sweeps={pbvi.sweeps} points={points}")
+    start = pbvi.beliefs.obs_index(4, 2, 3, Health.H_100.value)
+    for belief in (0, 0.25, 0.5, 0.75, 1):
+        # seeing the MM state can only help, so the MDP values bound the POMDP from above
+        bound = (1 - belief) * mdp_values[model.index(4, 2, 3, 0, 4)] + belief * mdp_values[model.index(4, 2, 3, 1, 4)]
+        print(f"(C,2,3,?,100) P(R)={belief:0.2f}: {pbvi.action(start, belief).name}=[{pbvi.value(start, belief):0.4f}]"
+              f" fully observed bound=[{bound:0.4f}]")
@@ -0,0 +1,113 @@
+"""Robust value iteration: every column's outcome distribution may be off.
+
+The rates in `action_value` (0.85/0.15 slips, the 0.5 attack, 0.8/0.2 waking)
+are estimates, so each column's distribution p is only known to lie in an
+ambiguity set around the nominal p0, on the nominal support:
+
+    l1        ||p - p0||_1 <= radius
+    interval  |p_i - p0_i| <= radius for every outcome
+
+and the backup takes the worst p in the set. Both inner problems are solved by
+a greedy pass over the outcomes sorted by target value r + gamma * V(s'): the
+L1 adversary moves radius / 2 of mass from the best outcomes onto the worst
+one, the interval adversary starts every outcome at its lower bound and fills
+the remaining mass in from the worst outcome up. One lexsort over (value,
+column) sorts every column at once, so a sweep costs O(n log n) in the number
+of outcomes instead of an LP per column.
+
+    python robust.py [task [gamma [radius [kind]]]]
+"""
+import sys
+import numpy as np
+
+import part_2
+from model import CompiledModel, load_model, value_iteration
+
+KINDS = ("l1", "interval")
+
+
+def _segment_cumsum(model: CompiledModel, x):
+    """Inclusive cumulative sum of x restarted at every column (x in column-grouped order)."""
+    total = np.cumsum(x)
+    start = np.concatenate(([0], total))[model.col_ptr[:-1]]
+    return total - start[model.trans_col]
+
+
+def worst_case(model: CompiledModel, target, radius, kind="l1"):
+    """Adversarial outcome probabilities (same layout as model.prob) against per-outcome targets."""
+    if kind not in KINDS:
+        raise ValueError(f"unknown ambiguity set {kind}, expected one of {KINDS}")
+    # outcomes of every column sorted by target, columns stay where they were
+    order = np.lexsort((target, model.trans_col))
+    prob = model.prob[order]
+    if kind == "interval":
+        lower = np.maximum(prob - radius, 0)
+        capacity = np.minimum(prob + radius, 1) - lower
+        left = 1 - np.bincount(model.trans_col, weights=lower, minlength=model.num_cols)
+        before = _segment_cumsum(model, capacity) - capacity
+        worst = lower + np.clip(left[model.trans_col] - before, 0, capacity)
+    else:
+        first = model.col_ptr[:-1][np.diff(model.col_ptr) > 0]
+        shift = np.zeros(model.num_cols)
+        shift[model.trans_col[first]] = np.minimum(radius / 2, 1 - prob[first])
+        # mass of the better outcomes of the same column, the best ones give theirs up first
+        after = np.bincount(model.trans_col, weights=prob, minlength=model.num_cols)[model.trans_col] \
+            - _segment_cumsum(model, prob)
+        worst = prob - np.clip(shift[model.trans_col] - after, 0, prob)
+        worst[first] += shift[model.trans_col[first]]
+    result = np.empty_like(worst)
+    result[order] = worst
+    return result
+
+
+def robust_q_values(model: CompiledModel, values, gamma, radius, kind="l1") -> np.ndarray:
+    target = model.reward + gamma * values[model.next_state]
+    prob = worst_case(model, target, radius, kind)
+    return np.bincount(model.trans_col, weights=prob * target, minlength=model.num_cols)
+
+
+def robust_value_iteration(model: CompiledModel, gamma, error, radius=0.1, kind="l1", max_iter=1000, values=None,
+                           progress=None):
+    """Same contract as `model.value_iteration`, with the worst distribution in every backup.
+
+    Returns (values, greedy column per state, number of sweeps).
+    """
+    values = np.zeros(model.num_states) if values is None else values
+    for iteration in range(max_iter):
+        new_values, policy = model.greedy(robust_q_values(model, values, gamma, radius, kind))
+        max_diff = np.abs(new_values - values).max()
+        values = new_values
+        if progress is not None:
+            progress(iteration, max_diff)
+        if max_diff <= error:
+            break
+    return values, policy, iteration + 1
+
+
+def worst_case_value(model: CompiledModel, policy, gamma, error, radius, kind="l1", max_iter=10 ** 5):
+    """Value of a fixed policy (one column per state) when the adversary picks every distribution."""
+    values = np.zeros(model.num_states)
+    for _ in range(max_iter):
+        new_values = robust_q_values(model, values, gamma, radius, kind)[policy]
+        max_diff = np.abs(new_values - values).max()
+        values = new_values
+        if max_diff <= error:
+            break
+    return values
+
+
+if __name__ == "__main__":
+    task = int(sys.argv[1]) if len(sys.argv) > 1 else part_2.task
+    gamma = float(sys.argv[2]) if len(sys.argv) > 2 else part_2.GAMMA
+    radius = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    kind = sys.argv[4] if len(sys.argv) > 4 else "l1"
+    model = load_model(task)
+    values, policy, sweeps = value_iteration(model, gamma, part_2.ERROR, max_iter=10 ** 5)
+    robust_values, robust_policy, robust_sweeps = robust_value_iteration(model, gamma, part_2.ERROR, radius, kind,
+                                                                         max_iter=10 ** 5)
+    print(f"{kind} radius={radius}: nominal sweeps={sweeps} robust sweeps={robust_sweeps}, "
+          f"{(model.col_action[policy] != model.col_action[robust_policy]).sum()} states change action")
+    start = model.index(4, 2, 3, 1, 4)
+    nominal_worst = worst_case_value(model, policy, gamma, part_2.ERROR, radius, kind)
+    print(f"{model.label(start)} nominal policy: nominal=[{values[start]:0.4f}] worst case=[{nominal_worst[start]:0.4f}]")
+    print(f"{model.label(start)} robust policy: worst case=[{robust_values[start]:0.4f}]")
@@ -0,0 +1,108 @@
+"""Sampled value iteration over the compiled transition model.
+
+Each Q-value is estimated from `k` successors drawn from its column's outcome
+distribution instead of summing over every outcome, so a sweep costs
+columns * k work no matter how far the dynamics fan out. Draws use alias
+tables built once per model (Vose's method), so each sample is O(1).
+
+The successors are drawn once and reused by every sweep (common random
+numbers), so the iteration is an exact contraction on the sampled model and
+converges; resampling every sweep instead leaves a noise floor that no
+stopping rule can tell apart from slow drift near gamma = 1.
+
+The stopping rule is per state: sweeps stop once every live state s moves by
+at most confidence * stderr_s / gamma, where stderr_s is the standard error of
+s's sampled backup (or by at most `error` where that is smaller). A state's
+remaining change is then inside the noise of its own backup, which further
+sweeps cannot reduce.
+
+The returned error estimate, (confidence * max stderr + max change * gamma) /
+(1 - gamma), is a loose bound rather than an error guarantee: it charges every
+state the worst backup error for 1 / (1 - gamma) steps, so near gamma = 1 it is
+orders of magnitude above the real error, and it holds per state at the
+confidence level, not simultaneously for all states.
+
+    python sampled.py [task [gamma [k]]]
+"""
+import sys
+import numpy as np
+
+import part_2
+from model import CompiledModel, load_model, value_iteration
+
+
+class AliasTables:
+    def __init__(self, model: CompiledModel):
+        self.model: CompiledModel = model
+        self.count: np.ndarray = np.diff(model.col_ptr)
+        # outcome j of column c is kept with probability accept[col_ptr[c] + j], else replaced by alias[...]
+        self.accept: np.ndarray = np.ones(len(model.prob))
+        self.alias: np.ndarray = np.arange(len(model.prob))
+        for col in np.flatnonzero(self.count > 1):
+            self._build(model.col_ptr[col], model.col_ptr[col + 1])
+
+    def _build(self, begin, end):
+        scaled = self.model.prob[begin:end] * (end - begin) / self.model.prob[begin:end].sum()
+        small = [idx for idx in range(end - begin) if scaled[idx] < 1]
+        large = [idx for idx in range(end - begin) if scaled[idx] >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.accept[begin + less] = scaled[less]
+            self.alias[begin + less] = begin + more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+
+    def sample(self, rng: np.random.Generator, k: int) -> np.ndarray:
+        """(columns x k) outcome indices, rows of terminal columns are meaningless and must be masked."""
+        slot = (rng.random((self.model.num_cols, k)) * self.count[:, None]).astype(np.int64)
+        picked = np.minimum(self.model.col_ptr[:-1, None] + slot, len(self.accept) - 1)
+        keep = rng.random(picked.shape) < self.accept[picked]
+        return np.where(keep, picked, self.alias[picked])
+
+
+def sampled_value_iteration(model: CompiledModel, gamma, error, k=8, confidence=1.96, max_iter=1000, values=None,
+                            seed=None, tables: AliasTables = None, progress=None):
+    """Returns (values, greedy column per state, number of sweeps, standard error of each state's backup,
+    loose bound on max |V - V*|, see the module docstring)."""
+    tables = AliasTables(model) if tables is None else tables
+    picked = tables.sample(np.random.default_rng(seed), k)
+    terminal = tables.count == 0
+    live = tables.count[model.state_ptr[:-1]] > 0
+    rewards, successors = model.reward[picked], model.next_state[picked]
+    rewards[terminal] = 0
+    values = np.zeros(model.num_states) if values is None else values
+    for iteration in range(max_iter):
+        samples = rewards + gamma * values[successors]
+        samples[terminal] = 0
+        new_values, policy = model.greedy(samples.mean(axis=1))
+        diff = np.abs(new_values - values)
+        max_diff = diff.max()
+        values = new_values
+        if progress is not None:
+            progress(iteration, max_diff)
+        if max_diff <= error:
+            break
+        if k > 1:
+            # every state's change against the noise of its own backup
+            stderr = samples[policy].std(axis=1, ddof=1) / np.sqrt(k)
+            if np.all(diff[live] * gamma <= np.maximum(confidence * stderr[live], error)):
+                break
+    stderr = samples[policy].std(axis=1, ddof=1) / np.sqrt(k) if k > 1 else np.zeros(model.num_states)
+    stderr[~live] = 0
+    value_error = (confidence * stderr.max() + max_diff * gamma) / (1 - gamma) if gamma < 1 else np.inf
+    return values, policy, iteration + 1, stderr, value_error
+
+
+if __name__ == "__main__":
+    task = int(sys.argv[1]) if len(sys.argv) > 1 else part_2.task
+    gamma = float(sys.argv[2]) if len(sys.argv) > 2 else part_2.GAMMA
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    model = load_model(task)
+    exact_values, exact_policy, exact_sweeps = value_iteration(model, gamma, part_2.ERROR)
+    values, policy, sweeps, stderr, value_error = sampled_value_iteration(model, gamma, part_2.ERROR, k, seed=0)
+    print(f"exact sweeps={exact_sweeps} sampled sweeps={sweeps} k={k}")
+    print(f"max |V - V_exact|={np.abs(values - exact_values).max():.4f} estimated error={value_error:.4f} "
+          f"(max backup stderr={stderr.max():.4f})")
+    # how much each state loses by following the sampled action, judged by the exact values
+    loss = exact_values - model.q_values(exact_values, gamma)[policy]
+    print(f"states losing > 0.5 under exact values: {(loss > 0.5).sum()} (max loss {loss.max():.4f})")
@@ -0,0 +1,192 @@
+"""Indexed store for value iteration traces.
+
+A text trace (`iteration=N` followed by one `(POS,MAT,ARROWS,MM,HEALTH):ACTION=[value]`
+line per state) is parsed once into an (iterations x states) table of actions
+and one of values, saved as .npy files under the store and memory-mapped back
+in. Columns are state indices, so questions like "when did the policy
+stabilize" or "which states act differently in task 2.1 and 2.2" are array
+operations instead of greps over 70k-line files. ValueIteration writes new runs
+straight into the store through a TraceWriter.
+
+    python trace_store.py import outputs/part_2_task_2.1_trace.txt ...
+    python trace_store.py stable NAME [STATE]
+    python trace_store.py diff NAME NAME [ITERATION]
+"""
+from typing import List
+import os
+import re
+import shutil
+import sys
+import warnings
+import numpy as np
+
+from model import CompiledModel, SHAPE
+from part_2 import Actions, MMState, Positions
+
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "outputs", "trace_store")
+ARRAYS = ("iterations", "actions", "values")
+LINE = re.compile(r"^(\(.*\)):(\w+)=\[(.*)\]$")
+LABELS = {CompiledModel.label(idx): idx for idx in range(int(np.prod(SHAPE)))}
+
+
+def state_index(state) -> int:
+    """Accepts a state index, a label like "(C,2,3,R,100)" or a tuple like ("C", 2, 3, "R", 100)."""
+    if isinstance(state, (int, np.integer)):
+        return int(state)
+    if isinstance(state, str):
+        return LABELS[state.replace(" ", "")]
+    pos, mat, arrow, mmst, health = state
+    return CompiledModel.index(Positions[pos].value, mat, arrow, MMState[mmst].value, health // 25)
+
+
+class Trace:
+    def __init__(self, name, iterations, actions, values):
+        self.name: str = name
+        self.iterations: np.ndarray = iterations
+        # actions[i, s] is the Actions value state s picked in row i, values[i, s] its value
+        self.actions: np.ndarray = actions
+        self.values: np.ndarray = values
+
+    def row(self, iteration) -> int:
+        """Row holding `iteration`, negative iterations count from the last recorded one."""
+        if iteration < 0:
+            if -iteration > len(self.iterations):
+                raise ValueError(f"trace {self.name} has only {len(self.iterations)} iterations")
+            return len(self.iterations) + iteration
+        row = int(np.searchsorted(self.iterations, iteration))
+        if row == len(self.iterations) or self.iterations[row] != iteration:
+            # Anderson runs, for one, only record their final sweep
+            recorded = f"iterations {self.iterations[0]}..{self.iterations[-1]}" if len(self.iterations) else "empty"
+            raise ValueError(f"iteration {iteration} is not recorded in trace {self.name} "
+                             f"({len(self.iterations)} rows, {recorded})")
+        return row
+
+    def policy(self, iteration=-1) -> List[Actions]:
+        return [Actions(action) for action in self.actions[self.row(iteration)]]
+
+    def stabilized(self) -> int:
+        """First iteration from which no state changes its action again."""
+        changed = np.flatnonzero((self.actions[1:] != self.actions[:-1]).any(axis=1))
+        return int(self.iterations[changed[-1] + 1 if len(changed) else 0])
+
+    def state_stabilized(self, state) -> int:
+        column = self.actions[:, state_index(state)]
+        changed = np.flatnonzero(column[1:] != column[:-1])
+        return int(self.iterations[changed[-1] + 1 if len(changed) else 0])
+
+    def flips(self, state):
+        """(iteration, old action, new action) for every change of the state's action."""
+        column = self.actions[:, state_index(state)]
+        changed = np.flatnonzero(column[1:] != column[:-1]) + 1
+        return [(int(self.iterations[row]), Actions(column[row - 1]), Actions(column[row])) for row in changed]
+
+    def history(self, state):
+        idx = state_index(state)
+        return self.iterations, self.actions[:, idx], self.values[:, idx]
+
+
+def policy_diff(a: Trace, b: Trace, iteration=-1) -> np.ndarray:
+    """States whose action differs between the two traces at `iteration` (default: each trace's last)."""
+    return np.flatnonzero(a.actions[a.row(iteration)] != b.actions[b.row(iteration)])
+
+
+def value_diff(a: Trace, b: Trace, iteration=-1) -> np.ndarray:
+    return b.values[b.row(iteration)] - a.values[a.row(iteration)]
+
+
+class TraceWriter:
+    def __init__(self, store, name):
+        self.store: TraceStore = store
+        self.name: str = name
+        self.iterations, self.actions, self.values = [], [], []
+
+    def record(self, iteration, values, actions):
+        self.iterations.append(iteration)
+        self.values.append(np.asarray(values, dtype=np.float64))
+        self.actions.append(np.asarray(actions, dtype=np.int8))
+
+    def close(self) -> Trace:
+        return self.store.save(Trace(self.name, np.array(self.iterations, dtype=np.int32),
+                                     np.array(self.actions, dtype=np.int8).reshape(-1, len(LABELS)),
+                                     np.array(self.values).reshape(-1, len(LABELS))))
+
+
+class TraceStore:
+    def __init__(self, root=STORE_DIR):
+        self.root: str = root
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if not name.endswith(".tmp"))
+
+    def save(self, trace: Trace) -> Trace:
+        path = os.path.join(self.root, trace.name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp, name + ".npy"), getattr(trace, name))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return trace
+
+    def load(self, name) -> Trace:
+        path = os.path.join(self.root, name)
+        return Trace(name, *[np.load(os.path.join(path, array + ".npy"), mmap_mode="r") for array in ARRAYS])
+
+    def writer(self, name) -> TraceWriter:
+        return TraceWriter(self, name)
+
+    def import_text(self, path, name=None) -> Trace:
+        """Parses a text trace; an incomplete last iteration (a trace cut off at exit) is dropped."""
+        name = name or os.path.splitext(os.path.basename(path))[0]
+        iterations, actions, values = [], [], []
+        filled = None
+        with open(path) as f:
+            for line in f:
+                if line.startswith("iteration="):
+                    if filled is not None and not filled.all():
+                        raise ValueError(f"{path}: iteration={iterations[-1]} is missing {(~filled).sum()} states")
+                    iterations.append(int(line[len("iteration="):]))
+                    actions.append(np.zeros(len(LABELS), dtype=np.int8))
+                    values.append(np.zeros(len(LABELS)))
+                    filled = np.zeros(len(LABELS), dtype=bool)
+                    continue
+                match = LINE.match(line.strip())
+                if match is None:
+                    continue
+                idx = LABELS[match.group(1)]
+                actions[-1][idx] = Actions[match.group(2)].value
+                values[-1][idx] = float(match.group(3))
+                filled[idx] = True
+        if filled is not None and not filled.all():
+            warnings.warn(f"{path}: dropping incomplete last iteration={iterations[-1]} "
+                          f"({(~filled).sum()} states missing)")
+            del iterations[-1], actions[-1], values[-1]
+        return self.save(Trace(name, np.array(iterations, dtype=np.int32),
+                               np.array(actions, dtype=np.int8).reshape(-1, len(LABELS)),
+                               np.array(values).reshape(-1, len(LABELS))))
+
+
+if __name__ == "__main__":
+    store = TraceStore()
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == "import":
+        for path in args:
+            trace = store.import_text(path)
+            print(f"{trace.name}: {len(trace.iterations)} iterations")
+    elif command == "stable":
+        trace = store.load(args[0])
+        if len(args) > 1:
+            print(f"{args[1]} final from iteration {trace.state_stabilized(args[1])}")
+            for iteration, old, new in trace.flips(args[1]):
+                print(f"    iteration={iteration} {old.name} -> {new.name}")
+        else:
+            print(f"policy stable from iteration {trace.stabilized()} of {trace.iterations[-1]}")
+    elif command == "diff":
+        a, b = store.load(args[0]), store.load(args[1])
+        iteration = int(args[2]) if len(args) > 2 else -1
+        delta = value_diff(a, b, iteration)
+        for idx in policy_diff(a, b, iteration):
+            print(f"{CompiledModel.label(idx)} {Actions(a.actions[a.row(iteration), idx]).name} -> "
+                  f"{Actions(b.actions[b.row(iteration), idx]).name} value {delta[idx]:+0.4f}")
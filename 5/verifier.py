@@ -0,0 +1,132 @@
+"""One-off verification of the compiled transition model.
+
+The solvers run without per-call checks, so everything they used to assert in
+the inner loop is checked here once instead: the dynamics don't raise for any
+action `State.filter_action` allows, legal-action lists agree with the filter,
+every column is a probability distribution, rewards stay in range and state
+indices round-trip. `filter_action` only knows the arrows, materials and
+terminal-state rules, not which actions a position offers, so the mask check
+covers those rules only. part_3 builds its own model and keeps its asserts.
+
+    python verifier.py [task]
+"""
+from typing import List
+import sys
+import numpy as np
+
+from model import CompiledModel, SHAPE, compile_model
+from part_2 import Actions, Health, State, ValueIteration, init_states
+
+TOLERANCE = 1e-9
+MAX_SHOWN = 10
+
+
+class VerificationReport:
+    def __init__(self):
+        # (check name, number of items checked, problems found)
+        self.checks: [(str, int, List[str])] = []
+
+    def add(self, name: str, checked: int, problems: List[str]):
+        self.checks.append((name, checked, problems))
+
+    @property
+    def ok(self) -> bool:
+        return all(not problems for _, _, problems in self.checks)
+
+    def __str__(self):
+        lines = []
+        for name, checked, problems in self.checks:
+            lines.append(f"{'FAIL' if problems else 'PASS'} {name} ({checked} checked, {len(problems)} problems)")
+            lines += ["    " + problem for problem in problems[:MAX_SHOWN]]
+            if len(problems) > MAX_SHOWN:
+                lines.append(f"    ... {len(problems) - MAX_SHOWN} more")
+        return "\n".join(lines)
+
+
+def check_dynamics(states: List[State]):
+    problems, checked = [], 0
+    for state in states:
+        for action in Actions:
+            if action == Actions.NONE or not state.filter_action(action):
+                continue
+            checked += 1
+            try:
+                results, _ = ValueIteration.transitions(action, state)
+                for _, info in results:
+                    ValueIteration.getIdx(info)
+            except Exception as e:
+                problems.append(f"{state} {action.name}: {type(e).__name__}: {e}")
+    return checked, problems
+
+
+def check_action_masks(model: CompiledModel, states: List[State]):
+    problems = []
+    for idx, state in enumerate(states):
+        actions = model.actions(np.arange(model.state_ptr[idx], model.state_ptr[idx + 1]))
+        if len(set(actions)) != len(actions):
+            problems.append(f"{state}: duplicate actions {[action.name for action in actions]}")
+        illegal = [action.name for action in actions if not state.filter_action(action)]
+        if illegal:
+            problems.append(f"{state}: actions {illegal} rejected by State.filter_action")
+        if state.health == Health.H_0 and actions != [Actions.NONE]:
+            problems.append(f"{state}: terminal state must only allow NONE")
+    return len(states), problems
+
+
+def check_stochastic(model: CompiledModel):
+    problems = []
+    outcomes = np.diff(model.col_ptr)
+    totals = np.bincount(model.trans_col, weights=model.prob, minlength=model.num_cols)
+    terminal = model.col_action == Actions.NONE.value
+    for col in np.flatnonzero(terminal & (outcomes > 0)):
+        problems.append(f"{model.label(model.col_state[col])} NONE: terminal column has outcomes")
+    for col in np.flatnonzero(~terminal & (np.abs(totals - 1) > TOLERANCE)):
+        problems.append(f"{model.label(model.col_state[col])} {Actions(model.col_action[col]).name}: "
+                        f"outcome probabilities sum to {totals[col]:.6f}")
+    for pos in np.flatnonzero((model.prob <= 0) | (model.prob > 1)):
+        col = model.trans_col[pos]
+        problems.append(f"{model.label(model.col_state[col])} {Actions(model.col_action[col]).name}: "
+                        f"outcome probability {model.prob[pos]}")
+    return model.num_cols, problems
+
+
+def check_rewards(model: CompiledModel):
+    low = min(model.step_cost, 0) - 40
+    high = max(model.step_cost, 0) + 50
+    problems = []
+    for pos in np.flatnonzero(~np.isfinite(model.reward) | (model.reward < low) | (model.reward > high)):
+        col = model.trans_col[pos]
+        problems.append(f"{model.label(model.col_state[col])} {Actions(model.col_action[col]).name} -> "
+                        f"{model.label(model.next_state[pos])}: reward {model.reward[pos]} outside [{low}, {high}]")
+    return len(model.reward), problems
+
+
+def check_indices(model: CompiledModel, states: List[State]):
+    problems = []
+    if model.num_states != len(states) or model.num_states != int(np.prod(SHAPE)):
+        problems.append(f"model has {model.num_states} states, expected {len(states)}")
+    for idx, state in enumerate(states):
+        if ValueIteration.getIdx(state.get_info()) != idx:
+            problems.append(f"{state}: getIdx gives {ValueIteration.getIdx(state.get_info())}, stored at {idx}")
+        elif model.label(idx) != str(state) or model.index(*np.unravel_index(idx, SHAPE)) != idx:
+            problems.append(f"{state}: index {idx} does not round-trip ({model.label(idx)})")
+    for pos in np.flatnonzero((model.next_state < 0) | (model.next_state >= model.num_states)):
+        problems.append(f"outcome {pos} points at state {model.next_state[pos]}")
+    return len(states), problems
+
+
+def verify(model: CompiledModel) -> VerificationReport:
+    states = init_states()
+    report = VerificationReport()
+    report.add("dynamics defined for every filtered action", *check_dynamics(states))
+    report.add("legal actions match State.filter_action", *check_action_masks(model, states))
+    report.add("columns are probability distributions", *check_stochastic(model))
+    report.add("rewards in range", *check_rewards(model))
+    report.add("state indices round-trip", *check_indices(model, states))
+    return report
+
+
+if __name__ == "__main__":
+    result = verify(compile_model(task=int(sys.argv[1]) if len(sys.argv) > 1 else 1))
+    print(result)
+    sys.exit(0 if result.ok else 1)